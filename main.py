@@ -8,15 +8,17 @@ from __future__ import annotations
 import logging
 import os
 import time
-import uuid
-from typing import Any, Dict, List, Optional
+from secrets import token_hex
+from typing import Any, Callable, Coroutine, Dict, List, Optional
 from pathlib import Path
 
 import anyio
+import orjson
 import uvicorn
-from fastapi import Depends, FastAPI, Request
+from fastapi import Depends, FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, ORJSONResponse
+from fastapi.routing import APIRoute
 from pydantic import BaseModel, Field
 
 from rules import ConstitutionEvidence, rulebook
@@ -25,6 +27,7 @@ from security import (
     RateLimiter,
     RateLimitError,
     UnauthorizedError,
+    api_key_digest,
     error_payload,
     get_allowed_origins,
     get_api_keys,
@@ -36,10 +39,13 @@ from security import (
 
 APP_VERSION = "1.1.0"
 MAX_BODY_SIZE = int(os.getenv("MAX_BODY_SIZE", "32768"))
+BODY_TOO_LARGE_MESSAGE = f"请求体大小超过限制 {MAX_BODY_SIZE} 字节"
 TIMEOUT_SECONDS = float(os.getenv("REQUEST_TIMEOUT_SECONDS", "5"))
 UI_PATH = Path(__file__).with_name("tcm_diagnosis.html")
 
 API_KEYS = get_api_keys()
+# 按 Key 的摘要查表鉴权（O(1)，不逐个比较明文 Key），值为日志用的 Key 标识
+API_KEY_DIGESTS: Dict[bytes, str] = {api_key_digest(key): hash_api_key(key) for key in API_KEYS}
 RATE_LIMITER = RateLimiter(get_rate_limit_per_minute())
 
 logging.basicConfig(
@@ -49,11 +55,35 @@ logging.basicConfig(
 logger = logging.getLogger("constitution_api")
 
 
+class ORJSONRequest(Request):
+    """使用 orjson 解析 JSON 请求体"""
+
+    async def json(self) -> Any:
+        if not hasattr(self, "_json"):
+            self._json = orjson.loads(await self.body())
+        return self._json
+
+
+class ORJSONRoute(APIRoute):
+    """路由处理时将请求替换为 ORJSONRequest"""
+
+    def get_route_handler(self) -> Callable[[Request], Coroutine[Any, Any, Response]]:
+        original_handler = super().get_route_handler()
+
+        async def route_handler(request: Request) -> Response:
+            return await original_handler(ORJSONRequest(request.scope, request.receive))
+
+        return route_handler
+
+
 app = FastAPI(
     title="中医体质判定 API",
     description="基于规则系统的中医体质分类与判定服务（非医疗诊断）",
     version=APP_VERSION,
+    default_response_class=ORJSONResponse,
 )
+# 需在注册路由前设置，之后声明的路由均使用 orjson 解析请求体
+app.router.route_class = ORJSONRoute
 
 allowed_origins = get_allowed_origins()
 if allowed_origins:
@@ -107,6 +137,34 @@ class ConstitutionResponse(BaseModel):
     disclaimer: str
 
 
+# 与请求无关的响应内容在启动时构建一次，按请求复用
+DISCLAIMER_FULL = (
+    "本服务基于规则系统进行体质倾向性分析，仅供参考，不构成医疗诊断。"
+    "不提供疾病诊断、用药建议或处方。如有健康问题，请咨询专业医生或中医师。"
+    "本服务不对任何医疗决策负责。"
+)
+
+# 建议数据由规则库维护，无需重复校验
+RECOMMENDATIONS_FROZEN: Dict[str, Recommendations] = {
+    const_type: Recommendations.model_construct(**rulebook.get_recommendations(const_type))
+    for const_type in rulebook.rules
+}
+
+INSUFFICIENT_RESPONSE = ConstitutionResponse(
+    primary_type="信息不足",
+    secondary_types=[],
+    confidence=0.0,
+    evidence=[],
+    recommendations=Recommendations(
+        lifestyle=[],
+        diet=[],
+        when_to_seek_help=["请补充更多症状信息后重新判定"],
+    ),
+    questions_to_clarify=rulebook.get_common_questions(),
+    disclaimer="本服务仅供参考，不构成医疗诊断。如有健康问题，请咨询专业医生或中医师。",
+)
+
+
 def format_evidence(evidence: ConstitutionEvidence) -> Dict[str, Any]:
     """格式化证据为响应格式"""
     return {
@@ -129,67 +187,84 @@ def verify_api_key(request: Request) -> str:
     if not token:
         raise UnauthorizedError("缺少或无效的 Authorization: Bearer <API_KEY>")
 
-    if not API_KEYS or token not in API_KEYS:
+    api_key_hash = API_KEY_DIGESTS.get(api_key_digest(token))
+    if api_key_hash is None:
         raise UnauthorizedError("API Key 无效")
 
     RATE_LIMITER.check(token)
-    api_key_hash = hash_api_key(token)
     request.state.api_key_hash = api_key_hash
     return token
 
 
+def limit_request_body(request: Request) -> None:
+    """无 content-length（分块传输）时边接收边累计请求体大小，超限立即中止"""
+    receive = request._receive
+    received = 0
+
+    async def limited_receive():
+        nonlocal received
+        message = await receive()
+        if message["type"] == "http.request":
+            received += len(message.get("body", b""))
+            if received > MAX_BODY_SIZE:
+                request.state.body_too_large = True
+                raise PayloadTooLargeError(BODY_TOO_LARGE_MESSAGE)
+        return message
+
+    request._receive = limited_receive
+
+
 @app.middleware("http")
 async def request_middleware(request: Request, call_next):
-    trace_id = str(uuid.uuid4())
+    trace_id = token_hex(8)
     request.state.trace_id = trace_id
-    start_time = time.time()
-    response: Optional[JSONResponse] = None
+    start_ns = time.monotonic_ns()
+    response: Optional[ORJSONResponse] = None
 
     try:
         if request.method in {"POST", "PUT", "PATCH"}:
             content_length = request.headers.get("content-length")
             if content_length and content_length.isdigit():
                 if int(content_length) > MAX_BODY_SIZE:
-                    raise PayloadTooLargeError(
-                        f"请求体大小超过限制 {MAX_BODY_SIZE} 字节"
-                    )
-            body = await request.body()
-            if len(body) > MAX_BODY_SIZE:
-                raise PayloadTooLargeError(
-                    f"请求体大小超过限制 {MAX_BODY_SIZE} 字节"
-                )
+                    raise PayloadTooLargeError(BODY_TOO_LARGE_MESSAGE)
+            else:
+                limit_request_body(request)
 
         with anyio.fail_after(TIMEOUT_SECONDS):
             response = await call_next(request)
 
+        # 下游解析请求体时的超限异常会被转换为 400，这里统一返回 413
+        if getattr(request.state, "body_too_large", False):
+            raise PayloadTooLargeError(BODY_TOO_LARGE_MESSAGE)
+
     except PayloadTooLargeError as exc:
-        response = JSONResponse(
+        response = ORJSONResponse(
             status_code=exc.status_code,
             content=error_payload(exc.code, exc.message, trace_id),
         )
     except RateLimitError as exc:
-        response = JSONResponse(
+        response = ORJSONResponse(
             status_code=exc.status_code,
             content=error_payload(exc.code, exc.message, trace_id),
         )
     except UnauthorizedError as exc:
-        response = JSONResponse(
+        response = ORJSONResponse(
             status_code=exc.status_code,
             content=error_payload(exc.code, exc.message, trace_id),
         )
     except Exception as exc:
         if isinstance(exc, anyio.exceptions.TimeoutError):
-            response = JSONResponse(
+            response = ORJSONResponse(
                 status_code=504,
                 content=error_payload("TIMEOUT", "请求处理超时", trace_id),
             )
         else:
-            response = JSONResponse(
+            response = ORJSONResponse(
                 status_code=500,
                 content=error_payload("INTERNAL_ERROR", "服务器内部错误", trace_id),
             )
 
-    latency_ms = int((time.time() - start_time) * 1000)
+    latency_ms = (time.monotonic_ns() - start_ns) // 1_000_000
     status_code = response.status_code if response else 500
     api_key_hash = getattr(request.state, "api_key_hash", "-")
     logger.info(
@@ -236,19 +311,7 @@ async def estimate_constitution(request: ConstitutionRequest):
     analysis_result = rulebook.analyze(request.text)
 
     if analysis_result.get("primary_type") == "信息不足":
-        return ConstitutionResponse(
-            primary_type="信息不足",
-            secondary_types=[],
-            confidence=0.0,
-            evidence=[],
-            recommendations=Recommendations(
-                lifestyle=[],
-                diet=[],
-                when_to_seek_help=["请补充更多症状信息后重新判定"],
-            ),
-            questions_to_clarify=rulebook.get_common_questions(),
-            disclaimer="本服务仅供参考，不构成医疗诊断。如有健康问题，请咨询专业医生或中医师。",
-        )
+        return INSUFFICIENT_RESPONSE
 
     primary_type = analysis_result["primary_type"]
     secondary_types = analysis_result.get("secondary_types", [])
@@ -260,23 +323,12 @@ async def estimate_constitution(request: ConstitutionRequest):
         if const_type in evidence_dict:
             evidence_list.append(format_evidence(evidence_dict[const_type]))
 
-    recommendations_dict = rulebook.get_recommendations(primary_type)
-    recommendations = Recommendations(
-        lifestyle=recommendations_dict.get("lifestyle", []),
-        diet=recommendations_dict.get("diet", []),
-        when_to_seek_help=recommendations_dict.get("when_to_seek_help", []),
-    )
+    recommendations = RECOMMENDATIONS_FROZEN[primary_type]
 
     questions_to_clarify = []
     if confidence < 0.5:
         questions_to_clarify = rulebook.get_common_questions()
 
-    disclaimer = (
-        "本服务基于规则系统进行体质倾向性分析，仅供参考，不构成医疗诊断。"
-        "不提供疾病诊断、用药建议或处方。如有健康问题，请咨询专业医生或中医师。"
-        "本服务不对任何医疗决策负责。"
-    )
-
     return ConstitutionResponse(
         primary_type=primary_type,
         secondary_types=secondary_types,
@@ -284,7 +336,7 @@ async def estimate_constitution(request: ConstitutionRequest):
         evidence=evidence_list,
         recommendations=recommendations,
         questions_to_clarify=questions_to_clarify,
-        disclaimer=disclaimer,
+        disclaimer=DISCLAIMER_FULL,
     )
 
 
@@ -293,5 +345,9 @@ if __name__ == "__main__":
         "main:app",
         host="0.0.0.0",
         port=8000,
+        loop="uvloop",
+        http="httptools",
+        limit_concurrency=int(os.getenv("UVICORN_LIMIT_CONCURRENCY", "200")),
+        workers=int(os.getenv("UVICORN_WORKERS", "1")),
         reload=os.getenv("RELOAD", "false").lower() == "true",
     )
@@ -3,13 +3,18 @@
 基于《中医体质分类与判定》九种体质标准
 """
 
+import sys
+from collections import OrderedDict
 from typing import Dict, List, Tuple, Optional
 from dataclasses import dataclass
 import re
 import math
 
+import ahocorasick
+import numpy as np
 
-@dataclass
+
+@dataclass(slots=True, frozen=True)
 class KeywordMatch:
     """关键词匹配结果"""
     keyword: str
@@ -17,7 +22,7 @@ class KeywordMatch:
     span: str  # 匹配到的文本片段
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class ConstitutionEvidence:
     """体质判定证据"""
     type: str
@@ -28,8 +33,169 @@ class ConstitutionEvidence:
 class ConstitutionRulebook:
     """体质判定规则库"""
     
+    # analyze 结果的 LRU 缓存容量（按输入文本）
+    ANALYSIS_CACHE_SIZE = 1024
+    
+    # 各体质的生活建议（类级常量，仅构建一次）
+    _RECOMMENDATIONS: Dict[str, Dict[str, List[str]]] = {
+        "平和质": {
+            "lifestyle": [
+                "保持规律作息，早睡早起",
+                "适度运动，如散步、慢跑、太极拳",
+                "保持心情愉悦，避免过度劳累"
+            ],
+            "diet": [
+                "饮食均衡，不偏食",
+                "可适量食用各类食物，保持营养平衡",
+                "避免暴饮暴食"
+            ],
+            "when_to_seek_help": [
+                "如出现明显不适症状，建议咨询专业中医师"
+            ]
+        },
+        "气虚质": {
+            "lifestyle": [
+                "避免过度劳累，注意休息",
+                "适度运动，以不感到疲劳为宜，如散步、太极拳",
+                "保证充足睡眠，避免熬夜"
+            ],
+            "diet": [
+                "可适当食用补气食物，如山药、大枣、小米等",
+                "避免生冷、寒凉食物",
+                "饮食规律，少食多餐"
+            ],
+            "when_to_seek_help": [
+                "如疲劳感持续加重，建议咨询专业中医师"
+            ]
+        },
+        "阳虚质": {
+            "lifestyle": [
+                "注意保暖，尤其是腹部和足部",
+                "适度运动，以温和运动为主，如慢跑、太极拳",
+                "多晒太阳，避免长时间待在寒冷环境"
+            ],
+            "diet": [
+                "可适当食用温阳食物，如羊肉、生姜、桂圆等",
+                "避免生冷、寒凉食物和冷饮",
+                "饮食宜温热"
+            ],
+            "when_to_seek_help": [
+                "如畏寒症状明显，建议咨询专业中医师"
+            ]
+        },
+        "阴虚质": {
+            "lifestyle": [
+                "避免熬夜，保证充足睡眠",
+                "适度运动，避免剧烈运动，可选择瑜伽、散步",
+                "保持心情平静，避免急躁"
+            ],
+            "diet": [
+                "可适当食用滋阴食物，如银耳、百合、梨等",
+                "避免辛辣、燥热食物",
+                "多喝水，饮食宜清淡"
+            ],
+            "when_to_seek_help": [
+                "如口干、失眠等症状明显，建议咨询专业中医师"
+            ]
+        },
+        "痰湿质": {
+            "lifestyle": [
+                "适度运动，以有氧运动为主，如快走、游泳",
+                "避免久坐，多活动",
+                "保证充足睡眠，但避免过度嗜睡"
+            ],
+            "diet": [
+                "饮食清淡，可适当食用健脾祛湿食物，如薏米、冬瓜、白萝卜等",
+                "避免油腻、甜腻、生冷食物",
+                "控制食量，避免暴饮暴食"
+            ],
+            "when_to_seek_help": [
+                "如体重持续增加或痰多症状明显，建议咨询专业中医师"
+            ]
+        },
+        "湿热质": {
+            "lifestyle": [
+                "适度运动，以出汗为宜，如慢跑、游泳",
+                "保持居住环境干燥通风",
+                "避免熬夜，保证充足睡眠"
+            ],
+            "diet": [
+                "饮食清淡，可适当食用清热祛湿食物，如绿豆、苦瓜、冬瓜等",
+                "避免辛辣、油腻、甜腻食物",
+                "少饮酒，多喝水"
+            ],
+            "when_to_seek_help": [
+                "如痤疮、口苦等症状明显，建议咨询专业中医师"
+            ]
+        },
+        "血瘀质": {
+            "lifestyle": [
+                "适度运动，促进血液循环，如慢跑、太极拳、瑜伽",
+                "保持心情愉悦，避免长期抑郁",
+                "保证充足睡眠"
+            ],
+            "diet": [
+                "可适当食用活血化瘀食物，如山楂、黑豆、玫瑰花茶等",
+                "避免生冷、寒凉食物",
+                "饮食宜温热"
+            ],
+            "when_to_seek_help": [
+                "如疼痛、色斑等症状明显，建议咨询专业中医师"
+            ]
+        },
+        "气郁质": {
+            "lifestyle": [
+                "保持心情愉悦，多与朋友交流",
+                "适度运动，如散步、瑜伽、听音乐",
+                "培养兴趣爱好，转移注意力",
+                "保证充足睡眠"
+            ],
+            "diet": [
+                "可适当食用理气食物，如柑橘、玫瑰花茶、薄荷等",
+                "避免过度饮酒和刺激性食物",
+                "饮食规律"
+            ],
+            "when_to_seek_help": [
+                "如情绪持续低落或出现明显抑郁症状，建议咨询专业心理医生或中医师"
+            ]
+        },
+        "特禀质": {
+            "lifestyle": [
+                "避免接触已知的过敏原",
+                "保持居住环境清洁，避免尘螨、花粉等",
+                "适度运动，增强体质，但避免在过敏季节户外运动",
+                "保证充足睡眠"
+            ],
+            "diet": [
+                "避免食用已知的过敏食物",
+                "饮食清淡，可适当食用抗过敏食物，如红枣、蜂蜜等",
+                "注意观察食物反应"
+            ],
+            "when_to_seek_help": [
+                "如出现严重过敏反应，应立即就医",
+                "建议咨询专业医生进行过敏原检测"
+            ]
+        },
+    }
+    
+    _DEFAULT_RECOMMENDATIONS: Dict[str, List[str]] = {
+        "lifestyle": ["保持规律作息，适度运动"],
+        "diet": ["饮食均衡，避免偏食"],
+        "when_to_seek_help": ["如有不适，建议咨询专业医生"]
+    }
+    
     def __init__(self):
         self.rules = self._build_rules()
+        # 体质类型按规则定义顺序编号，得分以数组下标对应体质
+        self._types = list(self.rules)
+        self._type_ids = {const_type: i for i, const_type in enumerate(self._types)}
+        self._kw_strings, kw_weights, kw_types = self._build_keyword_table()
+        self._automaton = self._build_automaton(self._kw_strings, kw_weights, kw_types)
+        # 权重与体质编号以并行数组保存，聚合时按命中下标批量取值
+        self._kw_weights = np.asarray(kw_weights, dtype=np.float32)
+        self._kw_types = np.asarray(kw_types, dtype=np.int8)
+        self._common_questions = self._build_common_questions()
+        self._analysis_cache: "OrderedDict[str, Dict]" = OrderedDict()
     
     def _build_rules(self) -> Dict[str, Dict]:
         """构建九种体质的规则库"""
@@ -201,71 +367,80 @@ class ConstitutionRulebook:
             },
         }
     
-    def match_keywords(self, text: str, constitution_type: str) -> List[KeywordMatch]:
-        """匹配文本中的关键词"""
-        matches = []
-        rule = self.rules.get(constitution_type)
-        if not rule:
-            return matches
-        
-        text_lower = text.lower()
-        
-        # 匹配关键词
-        for keyword, weight in rule["keywords"].items():
-            # 简单的包含匹配（可扩展为正则或更复杂的分词）
-            if keyword in text or keyword in text_lower:
-                # 尝试提取匹配的片段（前后各10个字符）
-                idx = text.find(keyword)
-                if idx == -1:
-                    idx = text_lower.find(keyword)
-                if idx != -1:
-                    start = max(0, idx - 10)
-                    end = min(len(text), idx + len(keyword) + 10)
-                    span = text[start:end]
-                    matches.append(KeywordMatch(keyword=keyword, weight=weight, span=span))
-        
-        return matches
+    def _build_keyword_table(self) -> Tuple[List[str], List[float], List[int]]:
+        """将所有体质的关键词与反证展平为并行数组（关键词、权重、体质编号）"""
+        # 每条 (关键词, 体质) 规则对应一个下标；关键词预先转小写，分析时只需匹配一次小写文本。
+        # 同一关键词在多种体质/反证中重复出现，intern 后共享同一字符串对象
+        kw_strings: List[str] = []
+        kw_weights: List[float] = []
+        kw_types: List[int] = []
+        for const_type, rule in self.rules.items():
+            type_id = self._type_ids[const_type]
+            for table in (rule["keywords"], rule["negatives"]):
+                for keyword, weight in table.items():
+                    kw_strings.append(sys.intern(keyword.lower()))
+                    kw_weights.append(weight)
+                    kw_types.append(type_id)
+        return kw_strings, kw_weights, kw_types
     
-    def calculate_score(self, text: str, constitution_type: str) -> Tuple[float, List[KeywordMatch]]:
-        """计算体质得分"""
-        rule = self.rules.get(constitution_type)
-        if not rule:
-            return 0.0, []
-        
-        score = 0.0
-        matches = self.match_keywords(text, constitution_type)
-        
-        # 正分：关键词匹配
-        for match in matches:
-            score += match.weight
-        
-        # 负分：反证匹配
-        text_lower = text.lower()
-        for negative, penalty in rule["negatives"].items():
-            if negative in text or negative in text_lower:
-                score += penalty  # penalty 已经是负数
+    def _build_automaton(
+        self, kw_strings: List[str], kw_weights: List[float], kw_types: List[int]
+    ) -> ahocorasick.Automaton:
+        """将关键词表编译为单个 Aho-Corasick 自动机"""
+        # 同一词可能出现在多种体质中，按词聚合其在关键词表中的下标
+        entry_ids: Dict[str, List[int]] = {}
+        for kw_id, keyword in enumerate(kw_strings):
+            entry_ids.setdefault(keyword, []).append(kw_id)
         
-        return max(0.0, score), matches
+        automaton = ahocorasick.Automaton()
+        for keyword, ids in entry_ids.items():
+            # 证据只记录正权重的关键词，预先取出 (体质编号, 权重) 以免扫描时再查数组
+            positives = tuple((kw_types[i], kw_weights[i]) for i in ids if kw_weights[i] > 0)
+            automaton.add_word(keyword, (keyword, tuple(ids), positives))
+        automaton.make_automaton()
+        return automaton
     
-    def normalize_confidence(self, scores: Dict[str, float]) -> Dict[str, float]:
-        """将得分归一化为置信度（使用 softmax-like 方法）"""
-        if not scores:
-            return {}
-        
+    def normalize_confidence(self, scores: np.ndarray) -> np.ndarray:
+        """将得分数组归一化为置信度（使用 softmax-like 方法）"""
         # 使用 score / (score + K) 方法，K=10 作为平滑参数
         K = 10.0
-        confidences = {}
-        for const_type, score in scores.items():
-            confidences[const_type] = score / (score + K)
+        confidences = scores / (scores + K)
         
         # 也可以使用 softmax（可选）
-        # total = sum(math.exp(s) for s in scores.values())
-        # confidences = {k: math.exp(v) / total for k, v in scores.items()}
+        # exp_scores = np.exp(scores)
+        # confidences = exp_scores / exp_scores.sum()
         
         return confidences
     
+    def _aggregate(self, hit_ids: List[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """按体质累加命中关键词的权重（截断为非负），并归一化为置信度"""
+        ids = np.asarray(hit_ids, dtype=np.intp)
+        # 无命中时 bincount 返回整数数组，由 maximum 统一为浮点
+        scores = np.maximum(
+            np.bincount(
+                self._kw_types[ids],
+                weights=self._kw_weights[ids],
+                minlength=len(self._types),
+            ),
+            0.0,
+        )
+        return scores, self.normalize_confidence(scores)
+    
     def analyze(self, text: str) -> Dict:
-        """分析文本，返回体质判定结果"""
+        """分析文本，返回体质判定结果（相同文本命中缓存，调用方不应修改返回值）"""
+        cached = self._analysis_cache.get(text)
+        if cached is not None:
+            self._analysis_cache.move_to_end(text)
+            return cached
+        
+        result = self._analyze(text)
+        self._analysis_cache[text] = result
+        if len(self._analysis_cache) > self.ANALYSIS_CACHE_SIZE:
+            self._analysis_cache.popitem(last=False)
+        return result
+    
+    def _analyze(self, text: str) -> Dict:
+        """执行关键词扫描与评分"""
         if not text or len(text.strip()) < 5:
             return {
                 "primary_type": "信息不足",
@@ -273,22 +448,38 @@ class ConstitutionRulebook:
                 "reason": "输入文本过短，无法进行有效判定"
             }
         
-        # 计算所有体质的得分
+        text_lower = text.lower()
+        # 个别字符转小写后长度会变化，此时片段改从小写文本截取以保证下标对齐
+        span_source = text if len(text_lower) == len(text) else text_lower
+        
+        # 单次扫描文本，命中结果分发到各体质（正权重为关键词，负权重为反证）
+        hit_ids: List[int] = []
+        matches: List[List[KeywordMatch]] = [[] for _ in self._types]
+        seen = set()
+        for end_idx, (keyword, ids, positives) in self._automaton.iter(text_lower):
+            # 每个词只计一次，片段取首次出现处（前后各10个字符）
+            if keyword in seen:
+                continue
+            seen.add(keyword)
+            start = end_idx - len(keyword) + 1
+            span = span_source[max(0, start - 10):end_idx + 11]
+            hit_ids.extend(ids)
+            for type_id, weight in positives:
+                matches[type_id].append(KeywordMatch(keyword=keyword, weight=weight, span=span))
+        
+        scores, confidences = self._aggregate(hit_ids)
+        
         all_scores = {}
         all_evidence = {}
-        
-        for const_type in self.rules.keys():
-            score, matches = self.calculate_score(text, const_type)
+        for type_id, const_type in enumerate(self._types):
+            score = float(scores[type_id])
             all_scores[const_type] = score
             all_evidence[const_type] = ConstitutionEvidence(
                 type=const_type,
                 score=score,
-                matched=matches
+                matched=matches[type_id]
             )
         
-        # 归一化置信度
-        confidences = self.normalize_confidence(all_scores)
-        
         # 找到最高分
         if not all_scores:
             return {
@@ -297,8 +488,11 @@ class ConstitutionRulebook:
                 "reason": "无法匹配到任何体质特征"
             }
         
-        sorted_types = sorted(all_scores.items(), key=lambda x: x[1], reverse=True)
-        primary_type, primary_score = sorted_types[0]
+        # 稳定排序：同分时保持规则定义顺序
+        order = np.argsort(-scores, kind="stable")
+        primary_id = int(order[0])
+        primary_type = self._types[primary_id]
+        primary_score = float(scores[primary_id])
         
         # 阈值判断：如果最高分太低，返回信息不足
         MIN_SCORE_THRESHOLD = 3.0
@@ -314,14 +508,15 @@ class ConstitutionRulebook:
         # 找到次要体质（分差在阈值内的前2个）
         secondary_types = []
         SECONDARY_THRESHOLD = 5.0  # 分差阈值
-        for const_type, score in sorted_types[1:3]:  # 取第2、3名
+        for type_id in order[1:3]:  # 取第2、3名
+            score = float(scores[type_id])
             if primary_score - score <= SECONDARY_THRESHOLD and score > 0:
-                secondary_types.append(const_type)
+                secondary_types.append(self._types[type_id])
         
         return {
             "primary_type": primary_type,
             "secondary_types": secondary_types,
-            "confidence": confidences.get(primary_type, 0.0),
+            "confidence": float(confidences[primary_id]),
             "primary_score": primary_score,
             "all_scores": all_scores,
             "evidence": all_evidence
@@ -329,161 +524,19 @@ class ConstitutionRulebook:
     
     def get_recommendations(self, constitution_type: str) -> Dict[str, List[str]]:
         """获取体质的生活建议"""
-        recommendations = {
-            "平和质": {
-                "lifestyle": [
-                    "保持规律作息，早睡早起",
-                    "适度运动，如散步、慢跑、太极拳",
-                    "保持心情愉悦，避免过度劳累"
-                ],
-                "diet": [
-                    "饮食均衡，不偏食",
-                    "可适量食用各类食物，保持营养平衡",
-                    "避免暴饮暴食"
-                ],
-                "when_to_seek_help": [
-                    "如出现明显不适症状，建议咨询专业中医师"
-                ]
-            },
-            "气虚质": {
-                "lifestyle": [
-                    "避免过度劳累，注意休息",
-                    "适度运动，以不感到疲劳为宜，如散步、太极拳",
-                    "保证充足睡眠，避免熬夜"
-                ],
-                "diet": [
-                    "可适当食用补气食物，如山药、大枣、小米等",
-                    "避免生冷、寒凉食物",
-                    "饮食规律，少食多餐"
-                ],
-                "when_to_seek_help": [
-                    "如疲劳感持续加重，建议咨询专业中医师"
-                ]
-            },
-            "阳虚质": {
-                "lifestyle": [
-                    "注意保暖，尤其是腹部和足部",
-                    "适度运动，以温和运动为主，如慢跑、太极拳",
-                    "多晒太阳，避免长时间待在寒冷环境"
-                ],
-                "diet": [
-                    "可适当食用温阳食物，如羊肉、生姜、桂圆等",
-                    "避免生冷、寒凉食物和冷饮",
-                    "饮食宜温热"
-                ],
-                "when_to_seek_help": [
-                    "如畏寒症状明显，建议咨询专业中医师"
-                ]
-            },
-            "阴虚质": {
-                "lifestyle": [
-                    "避免熬夜，保证充足睡眠",
-                    "适度运动，避免剧烈运动，可选择瑜伽、散步",
-                    "保持心情平静，避免急躁"
-                ],
-                "diet": [
-                    "可适当食用滋阴食物，如银耳、百合、梨等",
-                    "避免辛辣、燥热食物",
-                    "多喝水，饮食宜清淡"
-                ],
-                "when_to_seek_help": [
-                    "如口干、失眠等症状明显，建议咨询专业中医师"
-                ]
-            },
-            "痰湿质": {
-                "lifestyle": [
-                    "适度运动，以有氧运动为主，如快走、游泳",
-                    "避免久坐，多活动",
-                    "保证充足睡眠，但避免过度嗜睡"
-                ],
-                "diet": [
-                    "饮食清淡，可适当食用健脾祛湿食物，如薏米、冬瓜、白萝卜等",
-                    "避免油腻、甜腻、生冷食物",
-                    "控制食量，避免暴饮暴食"
-                ],
-                "when_to_seek_help": [
-                    "如体重持续增加或痰多症状明显，建议咨询专业中医师"
-                ]
-            },
-            "湿热质": {
-                "lifestyle": [
-                    "适度运动，以出汗为宜，如慢跑、游泳",
-                    "保持居住环境干燥通风",
-                    "避免熬夜，保证充足睡眠"
-                ],
-                "diet": [
-                    "饮食清淡，可适当食用清热祛湿食物，如绿豆、苦瓜、冬瓜等",
-                    "避免辛辣、油腻、甜腻食物",
-                    "少饮酒，多喝水"
-                ],
-                "when_to_seek_help": [
-                    "如痤疮、口苦等症状明显，建议咨询专业中医师"
-                ]
-            },
-            "血瘀质": {
-                "lifestyle": [
-                    "适度运动，促进血液循环，如慢跑、太极拳、瑜伽",
-                    "保持心情愉悦，避免长期抑郁",
-                    "保证充足睡眠"
-                ],
-                "diet": [
-                    "可适当食用活血化瘀食物，如山楂、黑豆、玫瑰花茶等",
-                    "避免生冷、寒凉食物",
-                    "饮食宜温热"
-                ],
-                "when_to_seek_help": [
-                    "如疼痛、色斑等症状明显，建议咨询专业中医师"
-                ]
-            },
-            "气郁质": {
-                "lifestyle": [
-                    "保持心情愉悦，多与朋友交流",
-                    "适度运动，如散步、瑜伽、听音乐",
-                    "培养兴趣爱好，转移注意力",
-                    "保证充足睡眠"
-                ],
-                "diet": [
-                    "可适当食用理气食物，如柑橘、玫瑰花茶、薄荷等",
-                    "避免过度饮酒和刺激性食物",
-                    "饮食规律"
-                ],
-                "when_to_seek_help": [
-                    "如情绪持续低落或出现明显抑郁症状，建议咨询专业心理医生或中医师"
-                ]
-            },
-            "特禀质": {
-                "lifestyle": [
-                    "避免接触已知的过敏原",
-                    "保持居住环境清洁，避免尘螨、花粉等",
-                    "适度运动，增强体质，但避免在过敏季节户外运动",
-                    "保证充足睡眠"
-                ],
-                "diet": [
-                    "避免食用已知的过敏食物",
-                    "饮食清淡，可适当食用抗过敏食物，如红枣、蜂蜜等",
-                    "注意观察食物反应"
-                ],
-                "when_to_seek_help": [
-                    "如出现严重过敏反应，应立即就医",
-                    "建议咨询专业医生进行过敏原检测"
-                ]
-            },
-        }
-        
-        return recommendations.get(constitution_type, {
-            "lifestyle": ["保持规律作息，适度运动"],
-            "diet": ["饮食均衡，避免偏食"],
-            "when_to_seek_help": ["如有不适，建议咨询专业医生"]
-        })
+        return self._RECOMMENDATIONS.get(constitution_type, self._DEFAULT_RECOMMENDATIONS)
     
     def get_common_questions(self) -> List[str]:
         """获取需要补充的关键问题"""
+        return self._common_questions
+    
+    def _build_common_questions(self) -> List[str]:
+        """汇总各体质的常见问题，去重后保留前10个（按规则定义顺序）"""
         questions = []
         for rule in self.rules.values():
             questions.extend(rule.get("common_questions", []))
-        # 去重并返回
-        return list(set(questions))[:10]  # 返回前10个不重复的问题
+        return list(dict.fromkeys(questions))[:10]
 
 
-# 全局规则库实例
+# 全局规则库实例（导入时构建；多进程部署时在 fork 前构建可由各 worker 共享，见 README）
 rulebook = ConstitutionRulebook()
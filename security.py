@@ -7,9 +7,11 @@ from __future__ import annotations
 import hashlib
 import os
 import time
-from collections import deque
 from dataclasses import dataclass
-from typing import Deque, Dict, List, Optional
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+
+RATE_LIMIT_WINDOW_NS = 60 * 1_000_000_000
 
 
 @dataclass
@@ -34,9 +36,9 @@ class PayloadTooLargeError(APIError):
         super().__init__(code="PAYLOAD_TOO_LARGE", message=message, status_code=413)
 
 
-def get_api_keys() -> List[str]:
+def get_api_keys() -> FrozenSet[str]:
     raw = os.getenv("API_KEYS", "")
-    return [k.strip() for k in raw.split(",") if k.strip()]
+    return frozenset(k.strip() for k in raw.split(",") if k.strip())
 
 
 def get_rate_limit_per_minute() -> int:
@@ -56,29 +58,57 @@ def get_allowed_origins() -> List[str]:
     return [o.strip() for o in raw.split(",") if o.strip()]
 
 
+def api_key_digest(api_key: str) -> bytes:
+    return hashlib.sha256(api_key.encode("utf-8")).digest()
+
+
 def hash_api_key(api_key: str) -> str:
-    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
+    return hashlib.blake2s(api_key.encode("utf-8"), digest_size=6).hexdigest()
 
 
 class RateLimiter:
+    """按 API Key 的滑动窗口计数限流（双桶加权近似，O(1)）"""
+
     def __init__(self, limit_per_minute: int):
         self.limit_per_minute = limit_per_minute
-        self._store: Dict[str, Deque[float]] = {}
+        # api_key -> (当前窗口起点 ns, 上一窗口计数, 当前窗口计数)
+        self._store: Dict[str, Tuple[int, int, int]] = {}
+        self._next_sweep = time.monotonic_ns() + RATE_LIMIT_WINDOW_NS
 
     def check(self, api_key: str) -> None:
-        now = time.time()
-        window_start = now - 60
-        bucket = self._store.setdefault(api_key, deque())
-
-        while bucket and bucket[0] < window_start:
-            bucket.popleft()
-
-        if len(bucket) >= self.limit_per_minute:
+        now = time.monotonic_ns()
+        if now >= self._next_sweep:
+            self._evict_idle(now)
+
+        window = RATE_LIMIT_WINDOW_NS
+        start, prev_count, count = self._store.get(api_key, (now, 0, 0))
+        elapsed = now - start
+        if elapsed >= window:
+            # 按整窗推进：只跨过一个窗口时当前计数成为上一窗口计数，否则清零
+            passed = elapsed // window
+            prev_count = count if passed == 1 else 0
+            count = 0
+            start += passed * window
+            elapsed -= passed * window
+
+        # 上一窗口的计数按其仍落在滑动窗口内的比例加权
+        weighted = prev_count * (window - elapsed) / window + count
+        if weighted >= self.limit_per_minute:
             raise RateLimitError(
                 message=f"超过每分钟 {self.limit_per_minute} 次的限制"
             )
 
-        bucket.append(now)
+        self._store[api_key] = (start, prev_count, count + 1)
+
+    def _evict_idle(self, now: int) -> None:
+        # 两个窗口内无请求的 key 已不影响限流结果，定期清理以控制内存
+        idle_after = 2 * RATE_LIMIT_WINDOW_NS
+        self._store = {
+            key: entry
+            for key, entry in self._store.items()
+            if now - entry[0] < idle_after
+        }
+        self._next_sweep = now + RATE_LIMIT_WINDOW_NS
 
 
 def parse_bearer_token(auth_header: Optional[str]) -> Optional[str]: